@@ -1,14 +1,14 @@
+import io
 import os
+import shutil
 import gradio as gr
 from typing import List, Tuple
 from pathlib import Path
 
-# Import your NVIDIA API key here
-# os.environ["NVIDIA_API_KEY"] = "your_nvidia_api_key_here"
-
-from utils import ensure_dirs, make_unique_path, guard_unrelated
+from utils import ensure_dirs, make_unique_path, guard_unrelated, detect_intents
 from ingestion import ingest, SUPPORTED_EXTENSIONS
-from rag_pipeline import build_vectorstore, build_qa_chain, build_summary_chain
+from rag_pipeline import (build_vectorstore, build_qa_chain, build_summary_chain, get_embeddings,
+                          get_collection_fingerprint, SmartRAGCache)
 
 
 def _get_file_info(f: gr.File) -> Tuple[str | None, str | None]:
@@ -39,9 +39,14 @@ def save_uploads(files: List[gr.File]) -> List[str]:
         ext = os.path.splitext(orig_name)[1].lower()
         if ext not in SUPPORTED_EXTENSIONS:
             continue
-        dest = make_unique_path("./uploads", orig_name)
-        with open(dest, "wb") as out, open(temp_path, "rb") as inp:
-            out.write(inp.read())
+        try:
+            # Same filesystem: hardlink, no bytes copied; the link itself claims the name
+            dest = make_unique_path("./uploads", orig_name, create=lambda p: os.link(temp_path, p))
+        except OSError:
+            # Cross-device or unsupported: claim an empty file, then copyfile streams in chunks
+            # (sendfile on Linux)
+            dest = make_unique_path("./uploads", orig_name)
+            shutil.copyfile(temp_path, dest)
         saved_paths.append(dest)
     return saved_paths
 
@@ -51,17 +56,34 @@ def index_files(uploaded_files: List[gr.File]):
     if not paths:
         return "No supported files uploaded.", None
     try:
-        chunks = ingest(paths)
-        vs = build_vectorstore(chunks)
-        return f"Indexed {len(chunks)} chunks from {len(paths)} files.", vs
+        vs, added = build_vectorstore(ingest(paths))
+        return f"Indexed {added} chunks from {len(paths)} files.", vs
     except RuntimeError as e:
         return str(e), None
     except Exception as e:
         return f"Indexing error: {e}", None
+    finally:
+        # Cached answers and summaries were grounded in the previous collection contents; a failed
+        # index may still have inserted some batches, so clear them on every path
+        answer_cache.clear()
+        summary_cache.clear()
 
 
 qa_chain = None
 summary_chain = None
+answer_cache = SmartRAGCache()
+# Summary text keyed by (collection fingerprint, "summary"); the summary only depends on the collection
+summary_cache: dict[tuple[str, str], str] = {}
+
+
+def _chunk_text(chunk) -> str:
+    """Text of a streamed LLM chunk; plain strings are passed through without a str() copy."""
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(str(x) for x in content)
+    return str(content)
 
 
 def ensure_chains():
@@ -78,26 +100,26 @@ def stream_answer(question: str, history: list[dict]):
     history = history + [{"role": "user", "content": question}]
     
     # Handle greetings and basic conversation
-    q_lower = question.lower().strip()
-    if any(greeting in q_lower for greeting in ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening']):
+    intents = detect_intents(question)
+    if "greeting" in intents:
         response = "Hello! I'm your Smart Contract Assistant. I can help you analyze uploaded contract documents. You can:\n\n• Upload documents in the sidebar\n• Ask questions about contract content\n• Generate summaries of your documents\n\nHow can I assist you today?"
         history = history + [{"role": "assistant", "content": response}]
         yield history, history
         return
     
-    if any(phrase in q_lower for phrase in ['how are you']):
+    if "how_are_you" in intents:
         response = "I'm doing well, thank you! I'm ready to help you analyze your contract documents. Have you uploaded any documents yet?"
         history = history + [{"role": "assistant", "content": response}]
         yield history, history
         return
     
-    if any(phrase in q_lower for phrase in ['what can you do', 'what are you', 'who are you', 'help']):
+    if "about" in intents:
         response = "I'm a Smart Contract Assistant powered by RAG (Retrieval Augmented Generation). I can:\n\n• **Analyze contract documents** - Upload PDF, DOCX, or TXT files\n• **Answer questions** about contract content with citations\n• **Generate summaries** of uploaded documents\n• **Provide insights** based on your specific contract data\n\nTo get started, upload your documents using the sidebar, then ask me anything about them!"
         history = history + [{"role": "assistant", "content": response}]
         yield history, history
         return
     
-    if any(phrase in q_lower for phrase in ['thanks', 'thank you']):
+    if "thanks" in intents:
         response = "You're welcome! Is there anything else I can help you with regarding your contract documents?"
         history = history + [{"role": "assistant", "content": response}]
         yield history, history
@@ -125,11 +147,18 @@ def stream_answer(question: str, history: list[dict]):
     yield history, history
 
     try:
-        for chunk in qa_chain.stream({"question": question}):
-            content = getattr(chunk, "content", chunk)
-            part = "\n".join(str(x) for x in content) if isinstance(content, list) else str(content)
-            history[-1]["content"] += part
+        query_embedding = get_embeddings().embed_query(question)
+        cached = answer_cache.lookup(query_embedding)
+        if cached is not None:
+            history[-1]["content"] = cached
             yield history, history
+            return
+        answer = io.StringIO()
+        for chunk in qa_chain(question, query_embedding):
+            answer.write(_chunk_text(chunk))
+            history[-1]["content"] = answer.getvalue()
+            yield history, history
+        answer_cache.insert(query_embedding, answer.getvalue())
     except Exception as e:
         history[-1]["content"] = f"Answer error: {e}"
         yield history, history
@@ -147,12 +176,18 @@ def stream_summary():
     # Provide a visible starting message for UX
     yield "Summarizing documents..."
     try:
+        key = (get_collection_fingerprint(), "summary")
+        cached = summary_cache.get(key)
+        if cached is not None:
+            yield cached
+            yield "\n\nDone."
+            return
+        summary = io.StringIO()
         for chunk in summary_chain.stream({}):
-            content = getattr(chunk, "content", chunk)
-            if isinstance(content, list):
-                yield "\n".join(str(x) for x in content)
-            else:
-                yield str(content)
+            part = _chunk_text(chunk)
+            summary.write(part)
+            yield part
+        summary_cache[key] = summary.getvalue()
         # Provide a small completion notice so the last chunk doesn't vanish
         yield "\n\nDone."
     except Exception as e:
@@ -167,18 +202,22 @@ def summarize_sync():
         return str(e)
     if summary_chain is None:
         return "Summary chain is not available. Please index documents first."
-    buf = ["Summarizing documents...\n"]
+    buf = io.StringIO()
+    buf.write("Summarizing documents...\n")
     try:
-        for chunk in summary_chain.stream({}):
-            content = getattr(chunk, "content", chunk)
-            if isinstance(content, list):
-                buf.append("\n".join(str(x) for x in content))
-            else:
-                buf.append(str(content))
-        buf.append("\n\nDone.")
+        key = (get_collection_fingerprint(), "summary")
+        cached = summary_cache.get(key)
+        if cached is not None:
+            buf.write(cached)
+        else:
+            start = buf.tell()
+            for chunk in summary_chain.stream({}):
+                buf.write(_chunk_text(chunk))
+            summary_cache[key] = buf.getvalue()[start:]
+        buf.write("\n\nDone.")
     except Exception as e:
-        buf.append(f"\n\nSummary error: {e}")
-    return "".join(buf)
+        buf.write(f"\n\nSummary error: {e}")
+    return buf.getvalue()
 
 
 def build_ui():
@@ -2,9 +2,6 @@ import os
 import time
 from typing import List, Tuple
 
-# Import your NVIDIA API key here
-# os.environ["NVIDIA_API_KEY"] = "your_nvidia_api_key_here"
-
 from rag_pipeline import build_qa_chain
 
 TEST_QUESTIONS = [
@@ -39,7 +36,7 @@ def run_evaluation() -> Tuple[float, float, float]:
     for q in TEST_QUESTIONS:
         start = time.time()
         buf = []
-        for chunk in chain.stream({"question": q}):
+        for chunk in chain(q):
             if hasattr(chunk, "content"):
                 buf.append(chunk.content)
             else:
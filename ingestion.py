@@ -1,10 +1,19 @@
 import os
 import io
-from typing import List, Dict, Any
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import List, Dict, Any, Iterable, Iterator
 
-from utils import ensure_dirs, char_chunk_text, build_chunk_metadata
+from utils import ensure_dirs, iter_chunks, build_chunk_metadata
 
 # File parsing dependencies (use lightweight fallbacks)
+try:
+    import pypdfium2 as pdfium  # C-backed PDFium bindings, much faster than PyPDF2
+except Exception:
+    pdfium = None
+
 try:
     import PyPDF2
 except Exception:
@@ -18,6 +27,10 @@ except Exception:
 
 SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".txt"}
 
+# Ingest runs inside the multi-threaded Gradio server; forking it could copy locks held by other
+# threads into the workers and deadlock them, so workers start from a fresh interpreter
+_POOL_CONTEXT = multiprocessing.get_context("spawn")
+
 
 def parse_txt(path: str) -> List[Dict[str, Any]]:
     with open(path, "r", encoding="utf-8", errors="ignore") as f:
@@ -26,10 +39,27 @@ def parse_txt(path: str) -> List[Dict[str, Any]]:
     return [{"text": text, "metadata": {"source": os.path.basename(path)}}]
 
 
-def parse_pdf(path: str) -> List[Dict[str, Any]]:
-    pages: List[Dict[str, Any]] = []
+def parse_pdf(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield one record per page so callers can chunk pages without holding the whole document."""
+    source = os.path.basename(path)
+    if pdfium is not None:
+        pdf = pdfium.PdfDocument(path)
+        try:
+            for i, page in enumerate(pdf, start=1):
+                try:
+                    textpage = page.get_textpage()
+                    text = textpage.get_text_range()
+                    textpage.close()
+                except Exception:
+                    text = ""
+                finally:
+                    page.close()
+                yield {"text": text, "metadata": {"source": source, "page": i}}
+        finally:
+            pdf.close()
+        return
     if PyPDF2 is None:
-        raise RuntimeError("PyPDF2 not installed. Install it to parse PDFs.")
+        raise RuntimeError("pypdfium2 or PyPDF2 not installed. Install one of them to parse PDFs.")
     with open(path, "rb") as f:
         reader = PyPDF2.PdfReader(f)
         for i, page in enumerate(reader.pages, start=1):
@@ -37,11 +67,7 @@ def parse_pdf(path: str) -> List[Dict[str, Any]]:
                 text = page.extract_text() or ""
             except Exception:
                 text = ""
-            pages.append({
-                "text": text,
-                "metadata": {"source": os.path.basename(path), "page": i}
-            })
-    return pages
+            yield {"text": text, "metadata": {"source": source, "page": i}}
 
 
 def parse_docx(path: str) -> List[Dict[str, Any]]:
@@ -60,7 +86,7 @@ def parse_docx(path: str) -> List[Dict[str, Any]]:
     return [{"text": text, "metadata": meta}]
 
 
-def parse_file(path: str) -> List[Dict[str, Any]]:
+def parse_file(path: str) -> Iterable[Dict[str, Any]]:
     ext = os.path.splitext(path)[1].lower()
     if ext == ".pdf":
         return parse_pdf(path)
@@ -71,24 +97,48 @@ def parse_file(path: str) -> List[Dict[str, Any]]:
     raise ValueError(f"Unsupported file type: {ext}")
 
 
-def chunk_records(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    chunks: List[Dict[str, Any]] = []
+def _parse_and_chunk(path: str) -> List[Dict[str, Any]]:
+    # Generators cannot cross process boundaries; chunk in the worker too, so the
+    # parent only merges finished chunk records
+    return list(chunk_records(parse_file(path)))
+
+
+def chunk_records(records: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
     cid = 1
     for rec in records:
         text = rec.get("text", "")
         base_meta = rec.get("metadata", {})
-        for ch in char_chunk_text(text):
-            meta = base_meta.copy()
-            meta.update(build_chunk_metadata(meta.get("source", "unknown"), meta.get("page"), cid))
-            chunks.append({"text": ch, "metadata": meta})
+        # Record-level fields are looked up once; each chunk gets one merged dict
+        source = os.path.basename(base_meta.get("source", "unknown"))
+        page = base_meta.get("page")
+        for ch in iter_chunks(text):
+            yield {"text": ch, "metadata": {**base_meta, **build_chunk_metadata(source, page, cid)}}
             cid += 1
-    return chunks
 
 
-def ingest(paths: List[str]) -> List[Dict[str, Any]]:
+def ingest(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    """Lazily parse and chunk files; consume the result once (e.g. with build_vectorstore)."""
     ensure_dirs()
-    all_chunks: List[Dict[str, Any]] = []
+    if len(paths) > 1:
+        # Parsing and chunking are CPU-bound; fan files out across cores. Single files stay
+        # in-process since worker startup would outweigh the gain.
+        workers = min(len(paths), os.cpu_count() or 1)
+        ex = ProcessPoolExecutor(max_workers=workers, mp_context=_POOL_CONTEXT)
+        try:
+            # At most `workers` files are in flight: the next file is submitted only when one is
+            # taken, so finished chunk lists cannot pile up while the embedder lags behind
+            pending_paths = iter(paths)
+            in_flight = deque(ex.submit(_parse_and_chunk, p) for p in islice(pending_paths, workers))
+            while in_flight:
+                chunks = in_flight.popleft().result()
+                for p in islice(pending_paths, 1):
+                    in_flight.append(ex.submit(_parse_and_chunk, p))
+                yield from chunks
+                del chunks  # release this file's chunks before waiting on the next one
+        finally:
+            # Also runs when the consumer fails and closes this generator: files not yet started
+            # are dropped instead of parsed before the error can be reported
+            ex.shutdown(wait=True, cancel_futures=True)
+        return
     for p in paths:
-        records = parse_file(p)
-        all_chunks.extend(chunk_records(records))
-    return all_chunks
+        yield from chunk_records(parse_file(p))
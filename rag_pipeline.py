@@ -1,11 +1,24 @@
+import io
 import os
-from typing import List, Dict, Any
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+import asyncio
+import functools
+from itertools import islice
+from collections import OrderedDict
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
 
 # Switch to langchain-chroma to address deprecation warnings
 from langchain_chroma import Chroma
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 
 # Fix imports for LongContextReorder across LangChain versions
 try:
@@ -17,89 +30,315 @@ except Exception:
         # Final fallback; will raise at runtime if used
         LongContextReorder = None  # type: ignore
 
-# Make NVIDIA endpoint imports resilient so the file can be analyzed without the package
+# Optional local ONNX embedder (pip install fastembed); selected with EMBED_BACKEND=fastembed
 try:
-    from langchain_nvidia_ai_endpoints import NVIDIAEmbeddings, ChatNVIDIA
+    from langchain_community.embeddings import FastEmbedEmbeddings
 except Exception:
-    NVIDIAEmbeddings = None  # type: ignore
-    ChatNVIDIA = None  # type: ignore
+    FastEmbedEmbeddings = None  # type: ignore
 
 # Disable Chroma telemetry to avoid capture() errors
 os.environ.setdefault("CHROMADB_TELEMETRY", "False")
 
 VECTORSTORE_DIR = "./vectorstore"
+# Chunks are embedded and inserted into Chroma 256 at a time, so memory stays bounded and each
+# window is one concurrent embed round: 4 requests of 64 (nv-embed accepts up to 96 per request),
+# with in-flight requests capped to stay under rate limits
+INSERT_BATCH_SIZE = 256
+EMBED_BATCH_SIZE = 64
+EMBED_CONCURRENCY = 5
+# Vectors keyed by chunk content hash, so re-uploaded documents only embed changed chunks
+EMBED_CACHE_PATH = os.path.join(VECTORSTORE_DIR, "embed_cache.sqlite3")
+
+
+FASTEMBED_MODEL = "BAAI/bge-small-en-v1.5"
+
+
+def _get_fastembed_embeddings(model: str):
+    if FastEmbedEmbeddings is None:
+        raise RuntimeError("langchain-community is not installed. Please install it from requirements.txt.")
+    try:
+        return FastEmbedEmbeddings(model_name=model, threads=os.cpu_count())
+    except ImportError:
+        raise RuntimeError("EMBED_BACKEND=fastembed requires the fastembed package. Install it with: pip install fastembed")
+
+
+def _nvidia_endpoints():
+    # Imported on first use: the package is slow to import and some versions validate the key
+    # or contact the endpoint at import time, which would delay app startup
+    try:
+        import langchain_nvidia_ai_endpoints
+    except Exception:
+        raise RuntimeError("langchain-nvidia-ai-endpoints is not installed. Please install it from requirements.txt.")
+    return langchain_nvidia_ai_endpoints
 
 
-def get_embeddings(model: str = "nvidia/nv-embed-v1"):
+# Clients are cached per model so every caller shares one instance and its keep-alive HTTP session
+@functools.lru_cache(maxsize=4)
+def get_embeddings(model: str | None = None):
+    # Local fastembed is opt-in: its vectors are incompatible with an index built with nv-embed
+    if os.environ.get("EMBED_BACKEND", "nvidia").lower() == "fastembed":
+        return _get_fastembed_embeddings(model or FASTEMBED_MODEL)
+    model = model or "nvidia/nv-embed-v1"
     api_key = os.environ.get("NVIDIA_API_KEY")
     if not api_key:
         raise RuntimeError(
             "NVIDIA_API_KEY is not set. Please set it to use NVIDIA endpoints.\n"
             "Get a key at https://build.nvidia.com and set NVIDIA_API_KEY environment variable."
         )
-    if NVIDIAEmbeddings is None:
-        raise RuntimeError("langchain-nvidia-ai-endpoints is not installed. Please install it from requirements.txt.")
-    return NVIDIAEmbeddings(model=model, truncate="END")
+    return _nvidia_endpoints().NVIDIAEmbeddings(model=model, truncate="END")
 
 
+@functools.lru_cache(maxsize=4)
 def get_llm(model: str = "meta/llama-3.1-8b-instruct"):
+    # Optional self-hosted NIM/vLLM endpoint; without it the hosted NVIDIA API is used
+    base_url = os.environ.get("NVIDIA_LLM_BASE_URL")
     api_key = os.environ.get("NVIDIA_API_KEY")
-    if not api_key:
+    if not api_key and not base_url:
         raise RuntimeError(
             "NVIDIA_API_KEY is not set. Please set it to use NVIDIA endpoints.\n"
             "Get a key at https://build.nvidia.com and set NVIDIA_API_KEY environment variable."
         )
-    if ChatNVIDIA is None:
-        raise RuntimeError("langchain-nvidia-ai-endpoints is not installed. Please install it from requirements.txt.")
+    ChatNVIDIA = _nvidia_endpoints().ChatNVIDIA
+    if base_url:
+        return ChatNVIDIA(model=model, base_url=base_url)
     return ChatNVIDIA(model=model)
 
 
-def build_vectorstore(chunks: List[Dict[str, Any]]):
+# "Lost in the middle" only matters for long contexts; below this many docs keep retrieval order
+REORDER_MIN_DOCS = 8
+
+# Vectors are stored at unit length, so inner product equals cosine similarity and HNSW can
+# skip the per-comparison normalization
+COLLECTION_METADATA = {"hnsw:space": "ip", "hnsw:M": 32, "hnsw:construction_ef": 200}
+
+
+def _unit_rows(vectors: List[List[float]]) -> np.ndarray:
+    arr = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(arr, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return arr / norms
+
+
+class _NormalizedEmbeddings(Embeddings):
+    """Wraps an embeddings client so queries are matched at unit length, like stored vectors."""
+
+    def __init__(self, base: Embeddings):
+        self.base = base
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return _unit_rows(self.base.embed_documents(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return _unit_rows([self.base.embed_query(text)])[0].tolist()
+
+
+# Process-wide Chroma handle: the persistent DB is opened once, however many chains are (re)built
+_VS = None
+_SINGLETON_LOCK = threading.Lock()
+
+
+def _get_vs_singleton():
+    global _VS
+    embeddings = get_embeddings()
+    with _SINGLETON_LOCK:
+        if _VS is None:
+            _VS = Chroma(collection_name="contracts",
+                         embedding_function=_NormalizedEmbeddings(embeddings),
+                         persist_directory=VECTORSTORE_DIR,
+                         collection_metadata=COLLECTION_METADATA)
+        return _VS
+
+
+async def _embed_batches(embeddings, texts: List[str]) -> List[List[float]]:
+    """Embed texts in fixed-size batches, keeping up to EMBED_CONCURRENCY requests in flight."""
+    sem = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+    async def _embed_batch(batch: List[str]) -> List[List[float]]:
+        async with sem:
+            return await embeddings.aembed_documents(batch)
+
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    results = await asyncio.gather(*(_embed_batch(b) for b in batches))
+    return [vec for batch in results for vec in batch]
+
+
+def _open_embed_cache() -> sqlite3.Connection:
+    os.makedirs(VECTORSTORE_DIR, exist_ok=True)
+    conn = sqlite3.connect(EMBED_CACHE_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS embed_cache ("
+        "model TEXT NOT NULL, hash TEXT NOT NULL, vec BLOB NOT NULL, PRIMARY KEY (model, hash))"
+    )
+    return conn
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _embed_with_cache(embeddings, cache: sqlite3.Connection, texts: List[str]) -> List[List[float]]:
+    # Vectors differ per model, so the model name is part of the cache key
+    model = getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None) or type(embeddings).__name__
+    hashes = [_text_hash(t) for t in texts]
+    uniq = list(dict.fromkeys(hashes))
+    rows = cache.execute(
+        f"SELECT hash, vec FROM embed_cache WHERE model = ? AND hash IN ({','.join('?' * len(uniq))})",
+        [model, *uniq],
+    ).fetchall()
+    found: Dict[str, List[float]] = {h: np.frombuffer(v, dtype=np.float32).tolist() for h, v in rows}
+
+    misses: Dict[str, str] = {}
+    for h, t in zip(hashes, texts):
+        if h not in found:
+            misses.setdefault(h, t)
+    if misses:
+        miss_hashes = list(misses)
+        # Batches are padded to their longest input on the embedding server, so mixing short and
+        # long chunks in arrival order wastes compute. Embed longest-first, then scatter back.
+        order = sorted(range(len(miss_hashes)), key=lambda i: -len(misses[miss_hashes[i]]))
+        sorted_vectors = asyncio.run(_embed_batches(embeddings, [misses[miss_hashes[i]] for i in order]))
+        for j, i in enumerate(order):
+            found[miss_hashes[i]] = sorted_vectors[j]
+        cache.executemany(
+            "INSERT OR REPLACE INTO embed_cache (model, hash, vec) VALUES (?, ?, ?)",
+            [(model, h, np.asarray(found[h], dtype=np.float32).tobytes()) for h in miss_hashes],
+        )
+        cache.commit()
+    return [found[h] for h in hashes]
+
+
+def _add_chunks(vs, embeddings, cache: sqlite3.Connection, chunks: List[Dict[str, Any]]) -> None:
     texts = [c["text"] for c in chunks]
     metadatas = [c["metadata"] for c in chunks]
-    embeddings = get_embeddings()
-    vs = Chroma(collection_name="contracts",
-                embedding_function=embeddings,
-                persist_directory=VECTORSTORE_DIR)
-    # Add in batches
-    if texts:
-        vs.add_texts(texts=texts, metadatas=metadatas)
-        # Since Chroma 0.4.x, manual persist is not needed
-    return vs
+    vectors = _unit_rows(_embed_with_cache(embeddings, cache, texts))
+    # Embed ourselves and pass the vectors in, so Chroma skips its serial embed path
+    vs._collection.add(ids=[str(uuid.uuid4()) for _ in texts],
+                       embeddings=vectors.tolist(),
+                       metadatas=metadatas,
+                       documents=texts)
 
 
-def get_retriever() -> Any:
+def build_vectorstore(chunks: Iterable[Dict[str, Any]]) -> Tuple[Any, int]:
+    """Embed and insert chunks INSERT_BATCH_SIZE at a time; returns (vectorstore, number of chunks added)."""
     embeddings = get_embeddings()
-    vs = Chroma(collection_name="contracts",
-                embedding_function=embeddings,
-                persist_directory=VECTORSTORE_DIR)
-    # Increase k for broader context during summarization/QA
-    return vs.as_retriever(search_kwargs={"k": 20})
+    vs = _get_vs_singleton()
+    it = iter(chunks)
+    added = 0
+    cache = _open_embed_cache()
+    try:
+        while True:
+            window = list(islice(it, INSERT_BATCH_SIZE))
+            if not window:
+                break
+            _add_chunks(vs, embeddings, cache, window)
+            added += len(window)
+    finally:
+        cache.close()
+        if added:
+            _invalidate_fingerprint()
+    # Since Chroma 0.4.x, manual persist is not needed
+    return vs, added
+
+
+# Fingerprint of the collection contents (hash of all chunk ids); results derived from the whole
+# collection, like the summary, can be memoized on it. Reset whenever chunks are added.
+_FINGERPRINT: Optional[str] = None
+
+
+def _invalidate_fingerprint() -> None:
+    global _FINGERPRINT
+    _FINGERPRINT = None
+
+
+def get_collection_fingerprint() -> str:
+    global _FINGERPRINT
+    if _FINGERPRINT is None:
+        ids = _get_vs_singleton()._collection.get(include=[])["ids"]
+        _FINGERPRINT = hashlib.blake2b(",".join(sorted(ids)).encode(), digest_size=16).hexdigest()
+    return _FINGERPRINT
+
+
+class SmartRAGCache:
+    """Answer cache keyed by query embedding, so near-duplicate questions skip retrieval and the LLM.
 
+    A lookup hits when the cosine similarity between the new query and a cached one is at least
+    `threshold`. Entries expire after `ttl` seconds and the least recently used entry is evicted
+    once `max_entries` is reached. Gradio runs events on worker threads, so every method holds
+    the instance lock while it touches the entries.
+    """
 
-def _format_docs(docs: List[Document]) -> str:
-    return "\n\n".join([d.page_content for d in docs])
+    def __init__(self, threshold: float = 0.97, max_entries: int = 256, ttl: float = 3600.0):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Tuple[np.ndarray, str, float]]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
 
+    @staticmethod
+    def _normalize(vec: List[float]) -> np.ndarray:
+        arr = np.asarray(vec, dtype=np.float32)
+        norm = np.linalg.norm(arr)
+        return arr / norm if norm else arr
 
-def _citations_from_docs(docs: List[Document]) -> str:
-    cites = []
-    for d in docs:
+    def lookup(self, query_embedding: List[float]) -> Optional[str]:
+        q = self._normalize(query_embedding)
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (_, _, ts) in self._entries.items() if now - ts > self.ttl]:
+                del self._entries[key]
+            best_key, best_sim = None, -1.0
+            for key, (vec, _, _) in self._entries.items():
+                sim = float(np.dot(q, vec))
+                if sim > best_sim:
+                    best_key, best_sim = key, sim
+            if best_key is None or best_sim < self.threshold:
+                return None
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key][1]
+
+    def insert(self, query_embedding: List[float], answer: str) -> None:
+        vec = self._normalize(query_embedding)
+        with self._lock:
+            self._entries[self._next_id] = (vec, answer, time.time())
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def get_retriever(k: int = 5, fetch_k: int = 20) -> Any:
+    vs = _get_vs_singleton()
+    # Fetch a broad candidate set, then keep the k most relevant-yet-diverse chunks (MMR);
+    # prefill cost grows with every chunk passed to the LLM
+    return vs.as_retriever(search_type="mmr",
+                           search_kwargs={"k": k, "fetch_k": fetch_k, "lambda_mult": 0.5})
+
+
+def _format_and_cite(docs: List[Document]) -> Tuple[str, str]:
+    """Build the context string and the deduplicated citation list in one pass over docs."""
+    ctx_buf = io.StringIO()
+    cites: List[str] = []
+    seen = set()
+    for i, d in enumerate(docs):
+        if i:
+            ctx_buf.write("\n\n")
+        ctx_buf.write(d.page_content)
         m = d.metadata or {}
         source = m.get("source", "unknown")
         page = m.get("page")
         chunk_id = m.get("chunk_id", "chunk_?")
-        if page is not None:
-            cites.append(f"[{source} p.{page} {chunk_id}]")
-        else:
-            cites.append(f"[{source} {chunk_id}]")
-    # dedupe
-    uniq = []
-    seen = set()
-    for c in cites:
-        if c not in seen:
-            uniq.append(c)
-            seen.add(c)
-    return " ".join(uniq)
+        key = (source, page, chunk_id)
+        if key not in seen:
+            seen.add(key)
+            if page is not None:
+                cites.append(f"[{source} p.{page} {chunk_id}]")
+            else:
+                cites.append(f"[{source} {chunk_id}]")
+    return ctx_buf.getvalue(), " ".join(cites)
 
 
 def build_qa_chain():
@@ -116,32 +355,31 @@ def build_qa_chain():
         ("human", "Question: {question}\n\nContext:\n{context}\n\nAnswer with citations: {citations}")
     ])
 
-    def prepare_docs(inputs: Dict[str, Any]):
-        # Support both raw string input and dict with question
-        q = inputs if isinstance(inputs, str) else inputs.get("question", "")
-        if not q:
-            return []
-        docs = retriever.invoke(q)  # List[Document]
-        return reordering.transform_documents(docs)
+    def qa_stream(question: str, query_embedding: Optional[List[float]] = None) -> Iterator[Any]:
+        """Retrieve, format and stream the LLM answer; a plain generator avoids per-token LCEL dispatch.
 
-    chain = (
-        # Normalize input to a dict containing question
-        RunnablePassthrough.assign(question=lambda x: x if isinstance(x, str) else x.get("question", ""))
-        | {"docs": prepare_docs, "question": lambda x: x["question"]}
-        | {
-            "context": lambda x: _format_docs(x.get("docs", [])),
-            "question": lambda x: x["question"],
-            "citations": lambda x: _citations_from_docs(x.get("docs", [])),
-        }
-        | prompt
-        | llm
-    )
+        Pass `query_embedding` (from get_embeddings().embed_query) when the caller already has it,
+        so retrieval does not embed the question a second time.
+        """
+        if not question:
+            docs = []
+        elif query_embedding is not None:
+            docs = retriever.vectorstore.max_marginal_relevance_search_by_vector(
+                _unit_rows([query_embedding])[0].tolist(), **retriever.search_kwargs)
+        else:
+            docs = retriever.invoke(question)
+        if len(docs) >= REORDER_MIN_DOCS:
+            docs = reordering.transform_documents(docs)
+        context, citations = _format_and_cite(docs)
+        messages = prompt.format_messages(question=question, context=context, citations=citations)
+        yield from llm.stream(messages)
 
-    return chain
+    return qa_stream
 
 
 def build_summary_chain():
-    retriever = get_retriever()
+    # Summaries need broad coverage of the documents, so keep more chunks than QA
+    retriever = get_retriever(k=20, fetch_k=40)
     if LongContextReorder is None:
         raise RuntimeError("LongContextReorder not available. Update langchain or install langchain-community per requirements.txt.")
     reordering = LongContextReorder()
@@ -157,7 +395,11 @@ def build_summary_chain():
     def gather_all_docs(_: Dict[str, Any]):
         # Fetch top documents using a broad query keyword
         docs = retriever.invoke("contract")
-        return reordering.transform_documents(docs)
+        return docs if len(docs) < REORDER_MIN_DOCS else reordering.transform_documents(docs)
+
+    def format_inputs(x: Dict[str, Any]):
+        context, citations = _format_and_cite(x.get("docs") or [])
+        return {"context": context, "citations": citations}
 
     def grounded_or_idk(payload: Dict[str, Any]):
         ctx = payload.get("context", "").strip()
@@ -168,10 +410,7 @@ def build_summary_chain():
 
     chain = (
         RunnablePassthrough.assign(docs=gather_all_docs)
-        | {
-            "context": lambda x: _format_docs(x["docs"]) if x.get("docs") else "",
-            "citations": lambda x: _citations_from_docs(x["docs"]) if x.get("docs") else "",
-        }
+        | format_inputs
         | grounded_or_idk
         | prompt
         | llm
@@ -0,0 +1,88 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+rag_pipeline = pytest.importorskip("rag_pipeline")
+SmartRAGCache = rag_pipeline.SmartRAGCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rag_pipeline, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def test_near_duplicate_query_hits():
+    cache = SmartRAGCache(threshold=0.97)
+    cache.insert([1.0, 0.0], "answer")
+    # Scale does not matter, only direction
+    assert cache.lookup([5.0, 0.1]) == "answer"
+
+
+def test_query_below_threshold_misses():
+    cache = SmartRAGCache(threshold=0.97)
+    cache.insert([1.0, 0.0], "answer")
+    assert cache.lookup([1.0, 1.0]) is None
+    assert SmartRAGCache().lookup([1.0, 0.0]) is None
+
+
+def test_best_match_wins():
+    cache = SmartRAGCache(threshold=0.9)
+    cache.insert([1.0, 0.0], "x")
+    cache.insert([0.95, 0.3], "xy")
+    assert cache.lookup([0.96, 0.28]) == "xy"
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = SmartRAGCache(ttl=60.0)
+    cache.insert([1.0, 0.0], "answer")
+    clock[0] += 60.0
+    assert cache.lookup([1.0, 0.0]) == "answer"
+    clock[0] += 1.0
+    assert cache.lookup([1.0, 0.0]) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SmartRAGCache(max_entries=2)
+    cache.insert([1.0, 0.0, 0.0], "a")
+    cache.insert([0.0, 1.0, 0.0], "b")
+    assert cache.lookup([1.0, 0.0, 0.0]) == "a"
+    cache.insert([0.0, 0.0, 1.0], "c")
+    assert cache.lookup([0.0, 1.0, 0.0]) is None
+    assert cache.lookup([1.0, 0.0, 0.0]) == "a"
+    assert cache.lookup([0.0, 0.0, 1.0]) == "c"
+
+
+def test_clear_drops_all_entries():
+    cache = SmartRAGCache()
+    cache.insert([1.0, 0.0], "answer")
+    cache.clear()
+    assert cache.lookup([1.0, 0.0]) is None
+
+
+def test_clear_while_other_threads_look_up():
+    cache = SmartRAGCache(max_entries=64)
+    errors = []
+    stop = threading.Event()
+
+    def chat():
+        i = 0
+        try:
+            while not stop.is_set():
+                cache.insert([1.0, float(i % 50)], str(i))
+                cache.lookup([1.0, float(i % 37)])
+                i += 1
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=chat) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for _ in range(2000):
+        cache.clear()
+    stop.set()
+    for t in threads:
+        t.join()
+    assert errors == []
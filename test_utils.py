@@ -0,0 +1,102 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+from utils import char_chunk_text, detect_intents
+
+
+def test_windows_step_by_chunk_max_minus_overlap():
+    text = "abcdefghijklmnopqrstuvwxyz"
+    assert char_chunk_text(text, chunk_max=10, overlap=3) == [text[0:10], text[7:17], text[14:24], text[21:26]]
+
+
+def test_sentence_breaks_do_not_move_the_cut():
+    assert char_chunk_text("One. Two. Three. Four.", chunk_min=4, chunk_max=10, overlap=3) == [
+        "One. Two.", "o. Three.", "e. Four.",
+    ]
+
+
+def test_chunk_min_does_not_change_the_windows():
+    text = ("x" * 149 + ". " + "y" * 849) * 3
+    chunks = char_chunk_text(text, chunk_min=100, chunk_max=400, overlap=200)
+    assert chunks == char_chunk_text(text, chunk_min=0, chunk_max=400, overlap=200)
+    assert [len(c) for c in chunks] == [400] * 14
+
+
+def test_final_window_is_partial():
+    assert [len(c) for c in char_chunk_text("a. " + "b" * 1300, chunk_min=0)] == [1200, 303]
+
+
+# Expected sets match the baseline's `phrase in question.lower()` checks, substring quirks included
+@pytest.mark.parametrize("question, intents", [
+    ("Hello there", {"greeting"}),
+    ("GOOD EVENING", {"greeting"}),
+    ("Shey", {"greeting"}),
+    ("This clause", {"greeting"}),
+    ("Which party pays?", {"greeting"}),
+    ("HOW ARE YOU", {"how_are_you"}),
+    ("hI, how are you?", {"greeting", "how_are_you"}),
+    ("What are you?", {"about"}),
+    ("What can you do", {"about"}),
+    ("Can you HELP me", {"about"}),
+    ("Helpful", {"about"}),
+    ("Thanks a lot", {"thanks"}),
+    ("thank you, who are you?", {"thanks", "about"}),
+    ("What is the termination fee?", set()),
+    ("Payment schedule", set()),
+])
+def test_detect_intents_matches_baseline(question, intents):
+    assert detect_intents(question) == intents
+
+
+def _load_utils(blocked):
+    """Load a private copy of utils with the given optional matcher modules made unimportable."""
+    spec = importlib.util.spec_from_file_location("_utils_" + "_".join(blocked or ["all"]),
+                                                  os.path.join(os.path.dirname(__file__), "utils.py"))
+    module = importlib.util.module_from_spec(spec)
+    with pytest.MonkeyPatch.context() as mp:
+        for name in blocked:
+            mp.setitem(sys.modules, name, None)
+        spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(params=["python", "ahocorasick", "re2", "ahocorasick+re2"])
+def guard_utils(request):
+    wanted = request.param.split("+") if request.param != "python" else []
+    for name in wanted:
+        pytest.importorskip(name)
+    module = _load_utils([name for name in ("ahocorasick", "re2") if name not in wanted])
+    assert (module._UNRELATED_AC is not None) == ("ahocorasick" in wanted)
+    assert (module._UNRELATED_SET is not None) == ("re2" in wanted)
+    return module
+
+
+# Expected results come from the baseline guard: lowercased question, \b keyword regexes, `.` not
+# crossing newlines, and small talk (substring match) always allowed
+@pytest.mark.parametrize("question, blocked", [
+    ("What is the WEATHER today?", True),
+    ("MoViE night", True),
+    ("Check the news", True),
+    ("Any food.", True),
+    ("music-video", True),
+    ("Songs", True),
+    ("Book a hotel", True),
+    ("Payment terms for travel expenses", True),
+    ("Write me a short Story", True),
+    ("PLAY a GAME with me", True),
+    ("Tell me a joke", True),
+    ("Tell me\na joke", False),
+    ("weathering of the building", False),
+    ("newsletter subscription", False),
+    ("foods and drinks", False),
+    ("recipes", False),
+    ("sports_news", False),
+    ("Which hotel is cheapest?", False),
+    ("Hi, what's the weather?", False),
+    ("What is the termination clause?", False),
+])
+def test_guard_unrelated_matches_baseline(guard_utils, question, blocked):
+    assert guard_utils.guard_unrelated(question) is blocked
@@ -1,124 +1,275 @@
+import itertools
 import os
 import re
-from typing import List, Dict, Any, Tuple
+import secrets
+import sys
+from functools import lru_cache
+from typing import Callable, Iterator, List, Dict, Any, Set, Tuple
 
+# Default for chunk_min, which the fixed-window chunker accepts but ignores
 CHUNK_MIN = 800
 CHUNK_MAX = 1200
 CHUNK_OVERLAP = 200
+# chunk_id strings below this are prebuilt and interned; larger ids are formatted on demand
+CHUNK_ID_CACHE_SIZE = 1024
+# Sequential name_1..name_N probes before make_unique_path switches to random suffixes
+UNIQUE_PATH_PROBES = 10
+
+
+class _SanitizeTable(dict):
+    """str.translate table: allowed ASCII maps to itself, every other codepoint to '_'."""
+
+    def __missing__(self, codepoint: int) -> int:
+        return ord("_")
+
+
+_SANITIZE_TABLE = _SanitizeTable(
+    (c, c) for c in range(128) if chr(c).isalnum() or chr(c) in "._-"
+)
+
+# Optional Aho-Corasick automaton (pip install pyahocorasick) for the keyword half of guard_unrelated
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None  # type: ignore
+
+# Optional RE2 (pip install google-re2): one linear-time automaton for all off-topic patterns
+try:
+    import re2
+except ImportError:
+    re2 = None  # type: ignore
+
+# Topics that are clearly unrelated to contract analysis: whole-word keywords plus a few phrase patterns
+UNRELATED_KEYWORDS = (
+    'weather', 'news', 'sports', 'movie', 'movies', 'music', 'song', 'songs',
+    'recipe', 'cooking', 'food',
+    'travel', 'vacation', 'hotel',
+)
+UNRELATED_PATTERNS = (
+    r'\bwrite.*story\b',
+    r'\bplay.*game\b',
+    r'\btell.*joke\b',
+)
+
+
+def _build_keyword_automaton():
+    automaton = ahocorasick.Automaton()
+    for kw in UNRELATED_KEYWORDS:
+        automaton.add_word(kw, len(kw))
+    automaton.make_automaton()
+    return automaton
+
+
+def _build_re2_set(patterns: Tuple[str, ...]):
+    options = re2.Options()
+    options.case_sensitive = False
+    pattern_set = re2.Set.SearchSet(options)
+    for p in patterns:
+        pattern_set.Add(p)
+    pattern_set.Compile()
+    return pattern_set
+
+
+if ahocorasick is not None:
+    _UNRELATED_AC = _build_keyword_automaton()
+    _UNRELATED_REGEXES = UNRELATED_PATTERNS
+else:
+    # Without the automaton the keywords join the same single-pass pattern match
+    _UNRELATED_AC = None
+    _UNRELATED_REGEXES = (r"\b(?:" + "|".join(UNRELATED_KEYWORDS) + r")\b",) + UNRELATED_PATTERNS
+
+if re2 is not None:
+    _UNRELATED_SET = _build_re2_set(_UNRELATED_REGEXES)
+    _UNRELATED_RE = None
+else:
+    _UNRELATED_SET = None
+    _UNRELATED_RE = re.compile("|".join(f"(?:{p})" for p in _UNRELATED_REGEXES), re.IGNORECASE)
+
+
+def _is_word_char(c: str) -> bool:
+    return c.isalnum() or c == "_"
+
+
+def _has_unrelated_keyword(question: str) -> bool:
+    """Scan the question once with the automaton; a hit counts only on whole-word bounds, like \\b."""
+    # The automaton matches exact characters, so this is the one per-call copy the guard makes;
+    # listing case variants of each keyword instead could not cover every mixed-case spelling
+    q = question.lower()
+    last = len(q) - 1
+    for end, length in _UNRELATED_AC.iter(q):
+        start = end - length + 1
+        if (start == 0 or not _is_word_char(q[start - 1])) and (end == last or not _is_word_char(q[end + 1])):
+            return True
+    return False
+
+
+_DIRS_READY = False
 
 
 def ensure_dirs():
+    # Runs on every upload and ingest; after the first call it is a single flag check
+    global _DIRS_READY
+    if _DIRS_READY:
+        return
     os.makedirs("./uploads", exist_ok=True)
     os.makedirs("./vectorstore", exist_ok=True)
+    _DIRS_READY = True
 
 
 def sanitize_filename(name: str) -> str:
     # Keep alphanum, dash, underscore, dot
-    name = re.sub(r"[^a-zA-Z0-9._-]", "_", name)
+    name = name.translate(_SANITIZE_TABLE)
     return name
 
 
-def make_unique_path(dest_dir: str, base_name: str) -> str:
+def _create_exclusive(path: str) -> None:
+    os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+
+
+def make_unique_path(dest_dir: str, base_name: str,
+                     create: Callable[[str], None] = _create_exclusive) -> str:
+    """Claim a free file name in dest_dir and return its path.
+
+    `create(path)` must create the file atomically and raise FileExistsError if it is taken
+    (the default creates an empty file with O_EXCL; os.link also qualifies). Letting the
+    create call report a clash avoids a separate exists() stat and the race between the check
+    and the caller writing the file.
+    """
     base_name = sanitize_filename(base_name)
-    full = os.path.join(dest_dir, base_name)
-    if not os.path.exists(full):
-        return full
     root, ext = os.path.splitext(base_name)
-    i = 1
-    while True:
-        candidate = os.path.join(dest_dir, f"{root}_{i}{ext}")
-        if not os.path.exists(candidate):
-            return candidate
-        i += 1
+    names = itertools.chain(
+        (base_name,),
+        (f"{root}_{i}{ext}" for i in range(1, UNIQUE_PATH_PROBES + 1)),
+        # Many uploads share this name: a random suffix avoids a long linear probe
+        (f"{root}_{secrets.token_hex(4)}{ext}" for _ in itertools.count()),
+    )
+    for name in names:
+        candidate = os.path.join(dest_dir, name)
+        try:
+            create(candidate)
+        except FileExistsError:
+            continue
+        return candidate
 
 
-def char_chunk_text(text: str,
-                     chunk_min: int = CHUNK_MIN,
-                     chunk_max: int = CHUNK_MAX,
-                     overlap: int = CHUNK_OVERLAP) -> List[str]:
-    """
-    Simple greedy chunker by characters, attempts max size, respects overlap.
-    """
-    text = text.strip()
-    chunks: List[str] = []
+def _chunk_spans(n: int, chunk_max: int, overlap: int) -> List[Tuple[int, int]]:
+    """Return the (start, end) offsets of each chunk_max window, stepping by chunk_max - overlap."""
+    spans: List[Tuple[int, int]] = []
     start = 0
-    n = len(text)
     while start < n:
         end = min(start + chunk_max, n)
-        # Try to end at a sentence boundary near end
-        window = text[start:end]
-        # Find last sentence break within window
-        m = re.search(r"[.!?]\s+[^\S\n]*$", window)
-        if m and (len(window) >= chunk_min):
-            end = start + m.end()
-            chunk = text[start:end]
-        else:
-            chunk = window
-        chunks.append(chunk)
+        spans.append((start, end))
         if end >= n:
             break
         start = max(0, end - overlap)
-    return [c.strip() for c in chunks if c.strip()]
+    return spans
+
+
+def iter_chunks(text: str,
+                chunk_min: int = CHUNK_MIN,
+                chunk_max: int = CHUNK_MAX,
+                overlap: int = CHUNK_OVERLAP) -> Iterator[str]:
+    """
+    Fixed-window chunker by characters: chunk_max windows, each sharing `overlap` chars with the next.
+
+    Every chunk but the last is chunk_max characters before stripping. chunk_min is accepted for
+    compatibility and ignored; cuts never move to sentence breaks. Yields stripped, non-empty
+    chunks one at a time so callers never hold every chunk at once.
+    """
+    text = text.strip()
+    # Offsets are computed first, so each chunk string is sliced exactly once
+    for s, e in _chunk_spans(len(text), chunk_max, overlap):
+        chunk = text[s:e].strip()
+        if chunk:
+            yield chunk
+
+
+def char_chunk_text(text: str,
+                     chunk_min: int = CHUNK_MIN,
+                     chunk_max: int = CHUNK_MAX,
+                     overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """List form of iter_chunks for callers that need all chunks at once."""
+    return list(iter_chunks(text, chunk_min, chunk_max, overlap))
+
+
+_CHUNK_ID_STRS = tuple(sys.intern(f"chunk_{i}") for i in range(CHUNK_ID_CACHE_SIZE))
 
 
-def build_chunk_metadata(source: str, page: int | None, chunk_id: int) -> Dict[str, Any]:
+def build_chunk_metadata(source_name: str, page: int | None, chunk_id: int) -> Dict[str, Any]:
+    # source_name is already a basename: callers strip the directory once per document, not per chunk
     meta: Dict[str, Any] = {
-        "source": os.path.basename(source),
-        "chunk_id": f"chunk_{chunk_id}",
+        "source": source_name,
+        "chunk_id": _CHUNK_ID_STRS[chunk_id] if 0 <= chunk_id < CHUNK_ID_CACHE_SIZE else f"chunk_{chunk_id}",
     }
     if page is not None:
         meta["page"] = page
     return meta
 
 
-def format_citation(meta: Dict[str, Any]) -> str:
-    source = meta.get("source", "unknown")
-    page = meta.get("page")
-    chunk_id = meta.get("chunk_id", "chunk_?")
+@lru_cache(maxsize=4096)
+def _format_citation(source: str, page: Any, chunk_id: str) -> str:
     if page is not None:
         return f"[{source} p.{page} {chunk_id}]"
     return f"[{source} {chunk_id}]"
 
 
+def format_citation(meta: Dict[str, Any]) -> str:
+    # Hits from the same source/page repeat across a retrieval, so the string is cached per tuple
+    return _format_citation(meta.get("source", "unknown"), meta.get("page"), meta.get("chunk_id", "chunk_?"))
+
+
 def join_citations(metadatas: List[Dict[str, Any]]) -> str:
-    uniq: List[str] = []
-    seen = set()
-    for m in metadatas:
-        c = format_citation(m)
-        if c not in seen:
-            uniq.append(c)
-            seen.add(c)
-    return " ".join(uniq)
+    # dict.fromkeys drops repeats and keeps first-seen order
+    return " ".join(dict.fromkeys(format_citation(m) for m in metadatas))
+
+
+# Small-talk phrases handled directly by the chat UI, grouped by intent
+INTENT_PHRASES: Dict[str, Tuple[str, ...]] = {
+    "greeting": ('hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening'),
+    "how_are_you": ('how are you',),
+    "about": ('what can you do', 'what are you', 'who are you', 'help'),
+    "thanks": ('thanks', 'thank you'),
+}
+
+# One alternation inside a lookahead: every offset is tried once, so a single pass reports all
+# intents whose phrase occurs anywhere in the question (same substring semantics as `in`)
+_INTENT_RE = re.compile("(?=(?:" + "|".join(
+    f"(?P<{tag}>{'|'.join(re.escape(p) for p in phrases)})" for tag, phrases in INTENT_PHRASES.items()
+) + "))", re.IGNORECASE)
+
+
+def detect_intents(question: str) -> Set[str]:
+    """Return the INTENT_PHRASES tags whose phrases appear in the question."""
+    return {m.lastgroup for m in _INTENT_RE.finditer(question) if m.lastgroup}
+
+
+# Greetings, polite phrases and questions about the assistant; plain substrings, like `in`
+_SMALL_TALK_RE = re.compile("|".join(re.escape(p) for phrases in INTENT_PHRASES.values() for p in phrases),
+                            re.IGNORECASE)
 
 
 def guard_unrelated(question: str) -> bool:
     """More permissive: only block clearly off-topic requests, allow greetings and general chat."""
-    q = question.lower().strip()
-    
-    # Allow common greetings and polite conversation
-    greetings = ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening', 'how are you', 'thanks', 'thank you']
-    if any(greeting in q for greeting in greetings):
-        return False
-    
-    # Allow questions about the assistant itself
-    if any(phrase in q for phrase in ['what can you do', 'what are you', 'who are you', 'help']):
+    # Allow common greetings, polite conversation and questions about the assistant itself
+    if _SMALL_TALK_RE.search(question):
         return False
     
     # Only block clearly unrelated topics
-    unrelated_patterns = [
-        r'\b(weather|news|sports|movies?|music|songs?)\b',
-        r'\b(recipe|cooking|food)\b',
-        r'\b(travel|vacation|hotel)\b',
-        r'\bwrite.*story\b',
-        r'\bplay.*game\b',
-        r'\btell.*joke\b'
-    ]
-    return any(re.search(p, q) for p in unrelated_patterns)
+    if _UNRELATED_AC is not None and _has_unrelated_keyword(question):
+        return True
+    if _UNRELATED_SET is not None:
+        return bool(_UNRELATED_SET.Match(question))
+    return bool(_UNRELATED_RE.search(question))
 
 
 def low_confidence(retrieved: List[Tuple[str, Dict[str, Any]]]) -> bool:
     """Very simple: if fewer than 2 chunks or total chars < 800, mark low confidence."""
     if len(retrieved) < 1:
         return True
-    total = sum(len(t[0]) for t in retrieved)
-    return total < 800
+    # Stop as soon as enough text is seen; usually after the first chunk or two
+    total = 0
+    for t in retrieved:
+        total += len(t[0])
+        if total >= 800:
+            return False
+    return True